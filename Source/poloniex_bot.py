@@ -2,11 +2,21 @@
 Poloniex bot
 '''
 
+import asyncio
 from datetime import datetime, timedelta
 import time
 import logging
-from pymongo import MongoClient
+from logging.handlers import QueueHandler, QueueListener
+import queue
+import aiohttp
+import diskcache
+import pandas
+import poloniex_mongo as pm
 import poloniex_wrapper as pw
+try:
+    from pymongoarrow.api import write as pymongoarrow_write
+except ImportError:
+    pymongoarrow_write = None
 
 __poloniex_api_key__ = None
 __poloniex_secret__ = None
@@ -15,16 +25,139 @@ __poloniex__ = pw.Poloniex(__poloniex_api_key__, __poloniex_secret__)
 __log_formatter__ = logging.Formatter('-'*50 + '\n%(levelname)s: %(asctime)s\n%(message)s')
 __log_file_handler__ = logging.FileHandler(datetime.today().strftime('%Y%m%d') + '_pb.log', mode='a')
 __log_file_handler__.setFormatter(__log_formatter__)
+__log_queue__ = queue.Queue(-1)
 __log__ = logging.getLogger('poloniex_bot_logger')
 __log__.setLevel(logging.DEBUG)
-__log__.addHandler(__log_file_handler__)
-__mongo_client__ = MongoClient()
-__poloniex_mongo_collection__ = __mongo_client__.poloniex
+__log__.addHandler(QueueHandler(__log_queue__))
+__log_listener__ = QueueListener(__log_queue__, __log_file_handler__, respect_handler_level=True)
+__log_listener__.start()
+__poloniex_mongo_collection__ = pm.__poloniex_mongo_collection__
 __poloniex_trade_history__ = __poloniex_mongo_collection__.trade_history
 __poloniex_zrx_trade_history__ = __poloniex_mongo_collection__.zrx_trade_history
 __poloniex_chart_data__ = __poloniex_mongo_collection__.chart_data
+__max_requests_per_second__ = 6
+__chart_numeric_columns__ = ['high', 'low', 'open', 'close', 'volume', 'quoteVolume', 'weightedAverage']
+__max_fetch_atempts__ = 5
+__fetch_cache__ = diskcache.Cache('./.poloniex_cache')
+__markets_cache__ = {}
+__markets_cache_ttl__ = 3600
 
-def get_trade_history_between_dates(start_date, end_date, currency_pairs=None, insert_to_database=False):
+class TokenBucket:
+    '''
+    Token bucket that keeps request scheduling just under Poloniex's 6-8 req/sec cap,
+    so the scraper never triggers 429 responses and their minute-long backoff stalls.
+    '''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        '''
+        Coroutine that takes one token, sleeping until the bucket refills when empty.
+        '''
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def _all_markets(btc_only=False):
+    '''
+    Method that returns the market list, cached for an hour so re-entering
+    the bot methods does not spend an API round-trip (and a rate-limit token)
+    on refetching it.
+    '''
+    cached = __markets_cache__.get(btc_only)
+    if cached is not None and time.monotonic() - cached[0] < __markets_cache_ttl__:
+        return cached[1]
+    markets = __poloniex__.get_all_btc_markets() if btc_only else __poloniex__.get_all_markets()
+    __markets_cache__[btc_only] = (time.monotonic(), markets)
+    return markets
+
+def date_windows(start_date, end_date, days=1):
+    '''
+    Method that splits a date range into a list of (start, end) windows of the given length in days.
+    '''
+    windows = []
+    current_date_start = start_date
+    current_date_end = start_date + timedelta(days=days) - timedelta(microseconds=1)
+    while current_date_start < end_date:
+        if current_date_end > end_date:
+            current_date_end = end_date
+        windows.append((current_date_start, current_date_end))
+        current_date_start += timedelta(days=days)
+        current_date_end += timedelta(days=days)
+    return windows
+
+async def fetch_window(session, semaphore, token_bucket, command, market, window_start, window_end, period=None):
+    '''
+    Coroutine that fetches one (market, window) slice of public API data.
+    The semaphore keeps the number of in-flight requests under Poloniex's rate cap.
+    Closed windows are memoized in a disk cache, so repeated runs skip the HTTP call.
+    '''
+    cache_key = (command, market, int(window_start.timestamp()), int(window_end.timestamp()), period)
+    if cache_key in __fetch_cache__:
+        cached = __fetch_cache__[cache_key]
+        if isinstance(cached, list):
+            return market, cached
+        # Evict non-list entries a previous run may have cached before the
+        # response shape was validated.
+        del __fetch_cache__[cache_key]
+    window_closed = window_end < datetime.now() - timedelta(seconds=period if period is not None else 60)
+    params = {
+        'command': command,
+        'currencyPair': market,
+        'start': str(window_start.timestamp()),
+        'end': str(window_end.timestamp())
+    }
+    if period is not None:
+        params['period'] = str(period)
+    window_start_str = window_start.strftime('%Y-%m-%d %H:%M:%S')
+    window_end_str = window_end.strftime('%Y-%m-%d %H:%M:%S')
+    for atempt in range(__max_fetch_atempts__):
+        async with semaphore:
+            __log__.info('fetch_window(%s, %s, %s, %s)', command, market, window_start_str, window_end_str)
+            print('Market: %s, %s - %s' % (market, window_start_str, window_end_str))
+            try:
+                await token_bucket.acquire()
+                async with session.get(pw.Poloniex.__url_root__ + 'public', params=params) as response:
+                    if response.status == 429:
+                        __log__.warning('Rate limited on %s (%s), backing off %d seconds', market, command, 2 ** atempt)
+                        await asyncio.sleep(2 ** atempt)
+                        continue
+                    data = await response.json()
+                    if not isinstance(data, list):
+                        # Poloniex reports errors as {'error': ...} with HTTP 200;
+                        # treat them like a failed window instead of handing the
+                        # dict to the processing loops.
+                        __log__.error('Unexpected response for %s (%s): %s', market, command, data)
+                        return market, None
+                    if window_closed:
+                        __fetch_cache__[cache_key] = data
+                    return market, data
+            except Exception:
+                __log__.exception('Public trade history method error')
+            await asyncio.sleep(1 / __max_requests_per_second__)
+    return market, None
+
+async def fetch_all_windows(command, market_windows, period=None):
+    '''
+    Coroutine that schedules one fetch_window task per (market, window) tuple
+    and gathers them over a shared HTTP session.
+    '''
+    semaphore = asyncio.Semaphore(__max_requests_per_second__)
+    token_bucket = TokenBucket(__max_requests_per_second__, __max_requests_per_second__)
+    async with aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0'}) as session:
+        tasks = [asyncio.create_task(fetch_window(session, semaphore, token_bucket, command, market, window_start, window_end, period))
+                 for market, window_start, window_end in market_windows]
+        return await asyncio.gather(*tasks)
+
+def get_trade_history_between_dates(start_date, end_date, currency_pairs=None, insert_to_database=False, batch_size=5000):
     '''
     Method that returns Poloniex trade history between two datetimes or inserts it into database.
     Examples:
@@ -34,39 +167,35 @@ def get_trade_history_between_dates(start_date, end_date, currency_pairs=None, i
             get_trade_history_between_dates(datetime(2017, 1, 1), datetime(2017, 1, 1, 12), ['BTC_STR', 'BTC_FLDC']
     '''
     if currency_pairs is None:
-        currency_pairs = __poloniex__.get_all_markets()
+        currency_pairs = _all_markets()
     __log__.info('get_trade_history_between_dates(%s, %s, %s)',
                  start_date.strftime('%Y-%m-%d %H:%M:%S'),
                  end_date.strftime('%Y-%m-%d %H:%M:%S'),
                  '[' + ', '.join([pair for pair in currency_pairs]) + ']')
+    market_windows = [(market, window_start, window_end)
+                      for market in currency_pairs
+                      for window_start, window_end in date_windows(start_date, end_date)]
+    results = asyncio.run(fetch_all_windows(pw.ApiPublicMethods.__return_trade_history__, market_windows))
     trade_history = []
-    for market in currency_pairs:
-        current_date_start = start_date
-        current_date_end = start_date + timedelta(days=1) - timedelta(microseconds=1)
-        while current_date_start < end_date:
-            if current_date_end > end_date:
-                current_date_end = end_date
-            __log__.info('__poloniex__.return_public_trade_history(%s, %s, %s)',
-                         market,
-                         current_date_start.strftime('%Y-%m-%d %H:%M:%S'),
-                         current_date_end.strftime('%Y-%m-%d %H:%M:%S'))
-            print('Market: %s, %s - %s' % (market, current_date_start.strftime('%Y-%m-%d %H:%M:%S'), current_date_end.strftime('%Y-%m-%d %H:%M:%S')))
-            try:
-                current_trade = __poloniex__.return_public_trade_history(market, current_date_start, current_date_end)
-                for trade_part in current_trade:
-                    trade_part['market'] = market
-                if insert_to_database:
-                    __poloniex_trade_history__.insert_many(current_trade)
-                else:
-                    trade_history += current_trade
-                current_date_start += timedelta(days=1)
-                current_date_end += timedelta(days=1)
-            except Exception:
-                __log__.exception('Public trade history method error')
+    pending = []
+    for market, current_trade in results:
+        if current_trade is None:
+            continue
+        for trade_part in current_trade:
+            trade_part['market'] = market
+        if insert_to_database:
+            pending += current_trade
+            if len(pending) >= batch_size:
+                __poloniex_trade_history__.insert_many(pending, ordered=False)
+                pending = []
+        else:
+            trade_history += current_trade
+    if insert_to_database and any(pending):
+        __poloniex_trade_history__.insert_many(pending, ordered=False)
     if not insert_to_database:
         return trade_history
 
-def get_complete_trade_history(currency_start_date=datetime(2017, 1, 1), currency_pairs=None, mongo_collection=None):
+def get_complete_trade_history(currency_start_date=datetime(2017, 1, 1), currency_pairs=None, mongo_collection=None, batch_size=5000):
     '''
     Method that returns Poloniex trade history between two datetimes or inserts it into database.
     Examples:
@@ -76,7 +205,7 @@ def get_complete_trade_history(currency_start_date=datetime(2017, 1, 1), currenc
             get_trade_history_between_dates(datetime(2017, 01, 01), datetime(2017, 6, 22, 12), ['BTC_STR', 'BTC_FLDC'])
     '''
     if currency_pairs is None:
-        currency_pairs = __poloniex__.get_all_markets()
+        currency_pairs = _all_markets()
         print('Jesi li siguran da zelis nastaviti sa dohvatom svih trzista?')
         c = input()
         if c.toLower() == 'n':
@@ -87,13 +216,32 @@ def get_complete_trade_history(currency_start_date=datetime(2017, 1, 1), currenc
                  start_date.strftime('%Y-%m-%d %H:%M:%S'),
                  end_date.strftime('%Y-%m-%d %H:%M:%S'),
                  '[' + ', '.join([pair for pair in currency_pairs]) + ']')
+    market_windows = [(market, window_start, window_end)
+                      for market in currency_pairs
+                      for window_start, window_end in date_windows(start_date, end_date)]
+    results = asyncio.run(fetch_all_windows(pw.ApiPublicMethods.__return_trade_history__, market_windows))
     trade_history = []
-    for market in currency_pairs:
-        current_date_start = start_date
-        current_date_end = start_date + timedelta(days=1) - timedelta(microseconds=1)
-        while current_date_start < end_date:
-            if current_date_end > end_date:
-                current_date_end = end_date
+    pending = []
+    for market, current_trade in results:
+        if current_trade is None:
+            continue
+        for trade_part in current_trade:
+            trade_part['market'] = market
+        if mongo_collection is not None:
+            pending += current_trade
+            if len(pending) >= batch_size:
+                mongo_collection.insert_many(pending, ordered=False)
+                pending = []
+        else:
+            trade_history += current_trade
+    if mongo_collection is not None and any(pending):
+        mongo_collection.insert_many(pending, ordered=False)
+    # Keep tailing the markets for trades made after the backfill above.
+    current_date_start = end_date
+    while True:
+        time.sleep(60)
+        current_date_end = datetime.now()
+        for market in currency_pairs:
             __log__.info('__poloniex__.return_public_trade_history(%s, %s, %s)',
                          market,
                          current_date_start.strftime('%Y-%m-%d %H:%M:%S'),
@@ -104,75 +252,60 @@ def get_complete_trade_history(currency_start_date=datetime(2017, 1, 1), currenc
                 for trade_part in current_trade:
                     trade_part['market'] = market
                 if mongo_collection is not None:
-                    mongo_collection.insert_many(current_trade)
+                    mongo_collection.insert_many(current_trade, ordered=False)
                 else:
                     trade_history += current_trade
-                if current_date_end + timedelta(days=1) > end_date:
-                    current_date_start = current_date_end
-                    time.sleep(60)
-                    current_date_end = end_date = datetime.now()
-                else:
-                    current_date_start += timedelta(days=1)
-                    current_date_end += timedelta(days=1)
             except Exception:
                 __log__.exception('Public trade history method error')
-    if mongo_collection is None:
-        return trade_history
+        current_date_start = current_date_end
+        if mongo_collection is None:
+            return trade_history
 
 
-def get_chart_data_between_dates(start_date, end_date, period, currency_pairs=None, insert_to_database=True):
+def get_chart_data_between_dates(start_date, end_date, period, currency_pairs=None, insert_to_database=True, batch_size=5000):
     '''
-    
+
     '''
     if currency_pairs is None:
-        currency_pairs = __poloniex__.get_all_btc_markets()
+        currency_pairs = _all_markets(btc_only=True)
     __log__.info('get_chart_data_between_dates(%s, %s, %d, %s)',
                  start_date.strftime('%Y-%m-%d %H:%M:%S'),
                  end_date.strftime('%Y-%m-%d %H:%M:%S'),
                  period,
                  '[' + ', '.join([pair for pair in currency_pairs]) + ']')
-    chart_data = []
+    market_windows = []
+    now = datetime.now()
     for market in currency_pairs:
-        current_date_start = start_date
-        current_date_end = start_date + timedelta(days=1) - timedelta(microseconds=1)
-        atempt = {}
-        while current_date_start < end_date:
-            if current_date_end > end_date:
-                current_date_end = end_date
-            __log__.info('__poloniex__.return_chart_data(%s, %s, %s, %d)',
-                         market,
-                         current_date_start.strftime('%Y-%m-%d %H:%M:%S'),
-                         current_date_end.strftime('%Y-%m-%d %H:%M:%S'),
-                         period)
-            print('Market: %s, %s - %s' % (market, current_date_start.strftime('%Y-%m-%d %H:%M:%S'), current_date_end.strftime('%Y-%m-%d %H:%M:%S')))
-            if current_date_start.strftime('%Y%m%d%H%M%S') not in atempt:
-                atempt[current_date_start.strftime('%Y%m%d%H%M%S')] = 1
+        for window_start, window_end in date_windows(start_date, end_date, days=30):
+            # Skip only closed windows whose final candle already landed;
+            # the window containing "now" (or one whose insert died midway)
+            # is partial and must be refetched.
+            if insert_to_database and window_end < now \
+                    and __poloniex_chart_data__.find_one({'market': market, 'date': {'$gte': window_end - timedelta(seconds=period), '$lte': window_end}}) is not None:
+                continue
+            market_windows.append((market, window_start, window_end))
+    results = asyncio.run(fetch_all_windows(pw.ApiPublicMethods.__return_chart_data__, market_windows, period))
+    chart_data = []
+    pending = []
+    for market, current_trade in results:
+        if current_trade is None or not any(current_trade):
+            continue
+        trade_df = pandas.DataFrame(current_trade)
+        trade_df[__chart_numeric_columns__] = trade_df[__chart_numeric_columns__].astype(float)
+        trade_df['date'] = pandas.to_datetime(trade_df['date'], unit='s')
+        trade_df['market'] = market
+        if insert_to_database:
+            if pymongoarrow_write is not None:
+                pymongoarrow_write(__poloniex_chart_data__, trade_df)
             else:
-                atempt[current_date_start.strftime('%Y%m%d%H%M%S')] += 1
-            try:
-                current_trade = __poloniex__.return_chart_data(market, current_date_start, current_date_end, period)
-                for trade_part in current_trade:
-                    trade_part['market'] = market
-                    trade_part['date'] = datetime.fromtimestamp(int(trade_part['date']))
-                    trade_part['high'] = float(trade_part['high'])
-                    trade_part['low'] = float(trade_part['low'])
-                    trade_part['open'] = float(trade_part['open'])
-                    trade_part['close'] = float(trade_part['close'])
-                    trade_part['volume'] = float(trade_part['volume'])
-                    trade_part['quoteVolume'] = float(trade_part['quoteVolume'])
-                    trade_part['weightedAverage'] = float(trade_part['weightedAverage'])
-                if insert_to_database:
-                    __poloniex_chart_data__.insert_many(current_trade)
-                else:
-                    chart_data += current_trade
-                current_date_start += timedelta(days=1)
-                current_date_end += timedelta(days=1)
-            except Exception:
-                __log__.exception('Public trade history method error')
-            if current_date_start.strftime('%Y%m%d%H%M%S') in atempt and atempt[current_date_start.strftime('%Y%m%d%H%M%S')] == 5:
-                current_date_start += timedelta(days=1)
-                current_date_end += timedelta(days=1)
-            #time.sleep(1)
+                pending += trade_df.to_dict('records')
+                if len(pending) >= batch_size:
+                    __poloniex_chart_data__.insert_many(pending, ordered=False)
+                    pending = []
+        else:
+            chart_data += trade_df.to_dict('records')
+    if insert_to_database and any(pending):
+        __poloniex_chart_data__.insert_many(pending, ordered=False)
     if not insert_to_database:
         return chart_data
 
@@ -181,6 +314,7 @@ def main():
     '''
     It all starts here...
     '''
+    pm.ensure_chart_data_indexes()
     # get_trade_history_between_dates(datetime(2017, 8, 17, 7, 0), datetime(2017, 8, 18, 5, 47), None, True)
     # data = __poloniex__.return_order_book('BTC_ETH', 10)
     # print(data)
@@ -188,11 +322,11 @@ def main():
     # print(buy_result)
     # get_complete_trade_history(__poloniex_zrx_trade_history__)
     # print(get_complete_trade_history(datetime(2017, 8, 19), ['BTC_ZRX'], __poloniex_zrx_trade_history__))
-    get_chart_data_between_dates(datetime(2017, 1, 1), datetime.now(), 300, 
-        [#'BTC_DOGE', 
-        #'BTC_NXT', 
-        #'BTC_ETH', 
-        #'BTC_STEEM', 
+    get_chart_data_between_dates(datetime(2017, 1, 1), datetime.now(), 300,
+        [#'BTC_DOGE',
+        #'BTC_NXT',
+        #'BTC_ETH',
+        #'BTC_STEEM',
         # 'BTC_ETC'
         'BTC_BCN' #,
         # 'BTC_ZRX'
@@ -0,0 +1,28 @@
+'''
+Shared MongoDB client for the Poloniex bots.
+Every module used to construct its own default MongoClient; this one is tuned for
+the scrapers: a bounded connection pool for concurrent bulk writes, wire
+compression for the numeric-heavy documents, and an acknowledged but
+unjournaled write concern on the ingest paths.
+'''
+
+from pymongo import MongoClient
+
+__mongo_client__ = MongoClient(maxPoolSize=64,
+                               minPoolSize=8,
+                               compressors='zstd,zlib',
+                               w=1,
+                               journal=False,
+                               retryWrites=True)
+__poloniex_mongo_collection__ = __mongo_client__.poloniex
+
+
+def ensure_chart_data_indexes():
+    '''
+    Method that creates the chart_data indexes the bots sort and hint on.
+    create_index is a no-op when the index already exists, so every reader
+    of chart_data can call this before issuing a hinted query.
+    '''
+    chart_data = __poloniex_mongo_collection__.chart_data
+    chart_data.create_index([('date', 1), ('market', 1)], background=True)
+    chart_data.create_index('market', background=True)
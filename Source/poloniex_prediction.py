@@ -2,21 +2,23 @@
 Prediction algorithm for Poloniex.
 '''
 
+import os
 import sys
 from datetime import datetime, timedelta
 import logging
 import time
 from collections import Counter
 import pymongo
-from pymongo import MongoClient
 import numpy
-from sklearn import cross_validation, linear_model, svm, neighbors
-from sklearn.ensemble import VotingClassifier, RandomForestClassifier
-from sklearn.tree import DecisionTreeClassifier
+from sklearn import cross_validation
+import lightgbm
+import joblib
+import numba
 import matplotlib.pyplot as plt
 from matplotlib import style
 import pickle
 import pandas
+import poloniex_mongo as pm
 import poloniex_wrapper as pw
 
 __poloniex_api_key__ = None
@@ -28,83 +30,103 @@ __log_file_handler__.setFormatter(__log_formatter__)
 __log__ = logging.getLogger('poloniex_prediction_logger')
 __log__.setLevel(logging.DEBUG)
 __log__.addHandler(__log_file_handler__)
-__mongo_client__ = MongoClient()
-__poloniex_mongo_collection__ = __mongo_client__.poloniex
+__poloniex_mongo_collection__ = pm.__poloniex_mongo_collection__
 __poloniex_chart_data__ = __poloniex_mongo_collection__.chart_data
 style.use('ggplot')
 
+@numba.njit(cache=True, fastmath=True)
+def label_kernel(volume, n_shift, buy_percentage, sell_percentage):
+    '''
+    Fused kernel that computes the forward volume change and the {-1, 0, 1}
+    label in one cache-friendly pass, instead of allocating shift, divide and
+    select temporaries for the small per-market arrays.
+    '''
+    labels = numpy.zeros(len(volume), numpy.int8)
+    for i in range(len(volume) - n_shift):
+        if volume[i] != 0:
+            change = (volume[i + n_shift] - volume[i]) / volume[i]
+            if change > buy_percentage:
+                labels[i] = 1
+            elif change < sell_percentage:
+                labels[i] = -1
+    return labels
+
+def _train_one_market(market, market_train_df):
+    '''
+    Method that trains and evaluates the classifier for one market.
+    Ran by the joblib workers, so the classifier itself trains single-threaded
+    to avoid oversubscribing the cores.
+    '''
+    x = market_train_df.drop(['market', 'prediction'], 1).to_numpy(dtype=numpy.float32)
+    y = market_train_df['prediction'].to_numpy(dtype=numpy.int8)
+    x_train, x_test, y_train, y_test = cross_validation.train_test_split(x, y, test_size=0.1)
+
+    classifier = lightgbm.LGBMClassifier(n_estimators=200, num_leaves=31, n_jobs=1)
+
+    classifier.fit(x_train, y_train)
+
+    accuracy = classifier.score(x_test, y_test)
+    print('Market', market, ['\t', ''][len(market) > 7] + '\taccuracy:', accuracy)
+    prediction = classifier.predict(x_test)
+    print(Counter(prediction))
+    print(Counter(y_test))
+    print(sum([[[0, 0.5][prediction[i] == 0], 1][prediction[i] == y_test[i]] for i in range(len(prediction))]) / len(prediction))
+    return market, classifier
+
 def volume_prediction(specific_market=None):
     '''
     Method for predicting buy, sell and wait actions.
     '''
     df = None
-    pickle_file = None
-    pickle_file_name = 'volume_prediction.pickle'
-    pickle_classifier_file = None
+    train_df_file_name = 'volume_prediction.parquet'
+    # Classifiers are pickled per market as <market>_<this name>; one shared
+    # file would keep only the last market trained.
     pickle_classifier_file_name = 'volume_prediction_classifier.pickle'
     if specific_market is not None:
-        pickle_file_name = specific_market + '_' + pickle_file_name
-        pickle_classifier_file_name = specific_market + '_' + pickle_classifier_file_name
-    try:
-        pickle_file = open(pickle_file_name, 'rb')
-    except IOError:
-        pickle_file = None
+        train_df_file_name = specific_market + '_' + train_df_file_name
     n_ticks_in_future = 1   # 1 tick is 5 minutess
-    if pickle_file is None:
-        chart_data_linq = __poloniex_chart_data__.find({}, { 'date': 1, 'volume': 1, 'quoteVolume': 1, 'market': 1 }).sort([('date', pymongo.ASCENDING), ('market', pymongo.ASCENDING)])
-        df = pandas.DataFrame(list(chart_data_linq))
+    if not os.path.isfile(train_df_file_name):
+        pm.ensure_chart_data_indexes()
+        chart_data_linq = __poloniex_chart_data__.find({}, { '_id': 0, 'date': 1, 'volume': 1, 'quoteVolume': 1, 'market': 1 }).sort([('date', pymongo.ASCENDING), ('market', pymongo.ASCENDING)]).hint([('date', pymongo.ASCENDING), ('market', pymongo.ASCENDING)]).batch_size(10000)
+        df = pandas.DataFrame.from_records(chart_data_linq)
         df.set_index('date', inplace=True)
-        df.drop(['_id'], 1, inplace=True)
         
-        markets = list(set(df['market'].values))
-        train_df = pandas.DataFrame()
-        for market in markets:
-            if specific_market is not None and specific_market != market:
-                continue
-            market_df = df.where(df['market'] == market).dropna()
+        if specific_market is not None:
+            df = df[df['market'] == specific_market]
+        market_frames = []
+        for market, market_df in df.groupby('market', sort=False):
+            market_df = market_df.copy()
             market_df['prediction_volume_percentage'] = (market_df['volume'].shift(-n_ticks_in_future) - market_df['volume']) / market_df['volume']
             market_df['prediction_volume_percentage'].replace([numpy.inf, -numpy.inf], numpy.NaN, inplace=True)
             buy_percentage = 0.4
             sell_percentage = -0.2
-            market_df['prediction'] = [[[0, -1][chng_perc < sell_percentage], 1][chng_perc > buy_percentage] for chng_perc in market_df['prediction_volume_percentage']]
+            market_df['prediction'] = label_kernel(market_df['volume'].to_numpy(dtype=numpy.float64),
+                                                   n_ticks_in_future, buy_percentage, sell_percentage)
             market_df.dropna(inplace=True)
-            train_df = train_df.append(market_df)
-        
-        with open(pickle_file_name, 'wb') as f:
-            pickle.dump(train_df, f)
+            market_frames.append(market_df)
+        train_df = pandas.concat(market_frames, copy=False)
+
+        train_df.to_parquet(train_df_file_name, compression='zstd', engine='pyarrow')
+        train_df.drop(['prediction_volume_percentage'], 1, inplace=True)
     else:
-        train_df = pickle.load(pickle_file)
-
-    markets = list(set(train_df['market'].values))
-    train_df.drop(['prediction_volume_percentage'], 1, inplace=True)
-    for market in markets:
-        market_train_df = train_df.where(train_df['market'] == market).dropna()
-        x, y = market_train_df.drop(['market', 'prediction'], 1).values, market_train_df['prediction'].values
-        x_train, x_test, y_train, y_test = cross_validation.train_test_split(x, y, test_size=0.1)
-
-        try:
-            pickle_classifier_file = open(pickle_classifier_file_name, 'rb')
-        except IOError:
-            pickle_classifier_file = None
-        if pickle_classifier_file is None:
-            classifier = VotingClassifier([('knc', neighbors.KNeighborsClassifier()),
-                                        ('lsvc', svm.LinearSVC()),
-                                        ('rfc', RandomForestClassifier()),
-                                        ('dtc', DecisionTreeClassifier())])
-            
-            classifier.fit(x_train, y_train)
-
-            accuracy = classifier.score(x_test, y_test)
-            print('Market', market, ['\t', ''][len(market) > 7] + '\taccuracy:', accuracy)
-            prediction = classifier.predict(x_test)
-            print(Counter(prediction))
-            print(Counter(y_test))
-            print(sum([[[0, 0.5][prediction[i] == 0], 1][prediction[i] == y_test[i]] for i in range(len(prediction))]) / len(prediction))
-        
-            with open(pickle_classifier_file_name, 'wb') as f:
+        train_df = pandas.read_parquet(train_df_file_name, columns=['volume', 'quoteVolume', 'market', 'prediction'], memory_map=True)
+
+    markets = train_df['market'].unique()
+    untrained_markets = [market for market in markets
+                         if not os.path.isfile(market + '_' + pickle_classifier_file_name)]
+    if untrained_markets:
+        trained_classifiers = joblib.Parallel(n_jobs=-1, backend='loky')(
+            joblib.delayed(_train_one_market)(market, market_train_df)
+            for market, market_train_df in train_df.groupby('market', sort=False)
+            if market in untrained_markets)
+
+        for market, classifier in trained_classifiers:
+            with open(market + '_' + pickle_classifier_file_name, 'wb') as f:
                 pickle.dump(classifier, f)
-        else:
-            classifier = pickle.load(pickle_classifier_file)
+    else:
+        for market in markets:
+            with open(market + '_' + pickle_classifier_file_name, 'rb') as f:
+                classifier = pickle.load(f)
             current_date_end = datetime.now()
             current_date_start = current_date_end - timedelta(minutes=5*n_ticks_in_future)
             period = 300*n_ticks_in_future
@@ -2,24 +2,24 @@
 Linear regression algorithm for Poloniex.
 '''
 
+import os
 from datetime import datetime
 import logging
 import time
 from collections import Counter
 import pymongo
-from pymongo import MongoClient
 import numpy
-from sklearn import cross_validation, linear_model, svm, neighbors
-from sklearn.ensemble import VotingClassifier, RandomForestClassifier
-from sklearn.tree import DecisionTreeClassifier
+from sklearn import cross_validation, linear_model
+import lightgbm
+import joblib
 import matplotlib.pyplot as plt
 from matplotlib import style
 import pickle
 import pandas
+import poloniex_mongo as pm
 import poloniex_wrapper as pw
 
-__mongo_client__ = MongoClient()
-__poloniex_mongo_collection__ = __mongo_client__.poloniex
+__poloniex_mongo_collection__ = pm.__poloniex_mongo_collection__
 __poloniex_tickers_regression__ = __poloniex_mongo_collection__.tickers_regression
 __poloniex_trade_history_regression__ = __poloniex_mongo_collection__.trade_history_regression
 __poloniex_zrx_trade_history__ = __poloniex_mongo_collection__.zrx_trade_history
@@ -42,60 +42,60 @@ def plot_results(real_data, test, forecast, date_times):
     plt.show()
 
 
+def _train_one_market(market, market_train_df):
+    '''
+    Method that trains and evaluates the classifier for one market.
+    Ran by the joblib workers, so the classifier itself trains single-threaded
+    to avoid oversubscribing the cores.
+    '''
+    x = market_train_df.drop(['market', 'prediction'], 1).to_numpy(dtype=numpy.float32)
+    y = market_train_df['prediction'].to_numpy(dtype=numpy.int8)
+    x_train, x_test, y_train, y_test = cross_validation.train_test_split(x, y, test_size=0.1)
+
+    classifier = lightgbm.LGBMClassifier(n_estimators=200, num_leaves=31, n_jobs=1)
+    classifier.fit(x_train, y_train)
+
+    accuracy = classifier.score(x_test, y_test)
+    print('Market', market, ['\t', ''][len(market) > 7] + '\taccuracy:', accuracy)
+    prediction = classifier.predict(x_test)
+    print(Counter(prediction))
+    print(Counter(y_test))
+    return market, classifier
+
+
 def volume_prediction():
     '''
     Method for predicting buy, sell and wait actions.
     '''
-    pickle_file = None
     df = None
-    pickle_file = None
-    try:
-        pickle_file = open('volume_prediction.pickle', 'rb')
-    except IOError:
-        pickle_file = None
-    if pickle_file is None:
-        df = pandas.DataFrame(list(__poloniex_chart_data__.find({}, { 'date': 1, 'volume': 1, 'quoteVolume': 1, 'market': 1 }).sort([('date', pymongo.ASCENDING), ('market', pymongo.ASCENDING)])))
+    train_df_file_name = 'volume_prediction.parquet'
+    if not os.path.isfile(train_df_file_name):
+        pm.ensure_chart_data_indexes()
+        df = pandas.DataFrame.from_records(__poloniex_chart_data__.find({}, { '_id': 0, 'date': 1, 'volume': 1, 'quoteVolume': 1, 'market': 1 }).sort([('date', pymongo.ASCENDING), ('market', pymongo.ASCENDING)]).hint([('date', pymongo.ASCENDING), ('market', pymongo.ASCENDING)]).batch_size(10000))
         df.set_index('date', inplace=True)
-        df.drop(['_id'], 1, inplace=True)
         
         n_ticks_in_future = 6   # 1 tick is 5 minutess
-        markets = list(set(df['market'].values))
-        train_df = pandas.DataFrame()
-        for market in markets:
-            market_df = df.where(df['market'] == market).dropna()
+        market_frames = []
+        for market, market_df in df.groupby('market', sort=False):
+            market_df = market_df.copy()
             market_df['prediction_volume_percentage'] = (market_df['volume'].shift(-n_ticks_in_future) - market_df['volume']) / market_df['volume']
             market_df['prediction_volume_percentage'].replace([numpy.inf, -numpy.inf], numpy.NaN, inplace=True)
             buy_percentage = 0.4
             sell_percentage = -0.2
-            market_df['prediction'] = [[[0, -1][chng_perc < sell_percentage], 1][chng_perc > buy_percentage] for chng_perc in market_df['prediction_volume_percentage']]
+            change_percentages = market_df['prediction_volume_percentage'].to_numpy()
+            market_df['prediction'] = numpy.select([change_percentages > buy_percentage, change_percentages < sell_percentage],
+                                                   [1, -1], default=0).astype(numpy.int8)
             market_df.dropna(inplace=True)
-            train_df = train_df.append(market_df)
+            market_frames.append(market_df)
+        train_df = pandas.concat(market_frames, copy=False)
 
-        with open('volume_prediction.pickle', 'wb') as f:
-            pickle.dump(train_df, f)
+        train_df.to_parquet(train_df_file_name, compression='zstd', engine='pyarrow')
+        train_df.drop(['prediction_volume_percentage'], 1, inplace=True)
     else:
-        train_df = pickle.load(pickle_file)
-
-    markets = list(set(train_df['market'].values))
-    train_df.drop(['close', 'prediction_volume_percentage'], inplace=True)
-    for market in markets:
-        market_train_df = train_df.where(train_df['market'] == market).dropna()
-        x, y = market_train_df.drop(['market', 'prediction'], 1).values, market_train_df['prediction'].values
-        x_train, x_test, y_train, y_test = cross_validation.train_test_split(x, y, test_size=0.1)
-
-        # classifier = VotingClassifier([('knc', neighbors.KNeighborsClassifier()),
-        #                                 ('lsvc', svm.LinearSVC()),
-        #                                 ('rfc', RandomForestClassifier()),
-        #                                 ('dtc', DecisionTreeClassifier())])
-
-        classifier = DecisionTreeClassifier()
-        classifier.fit(x_train, y_train)
-            
-        accuracy = classifier.score(x_test, y_test)
-        print('Market', market, ['\t', ''][len(market) > 7] + '\taccuracy:', accuracy)
-        prediction = classifier.predict(x_test)
-        print(Counter(prediction))
-        print(Counter(y_test))
+        train_df = pandas.read_parquet(train_df_file_name, columns=['volume', 'quoteVolume', 'market', 'prediction'], memory_map=True)
+    joblib.Parallel(n_jobs=-1, backend='loky')(
+        joblib.delayed(_train_one_market)(market, market_train_df)
+        for market, market_train_df in train_df.groupby('market', sort=False))
 
 
 def price_regression():
@@ -3,43 +3,68 @@ Poloniex scraping bot
 Its purpose is to get ticker data every minute and insert them it database.
 '''
 
+import atexit
 from datetime import datetime
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import queue
 import time
-from pymongo import MongoClient
+import poloniex_mongo as pm
 import poloniex_wrapper as pw
 
 __poloniex__ = pw.Poloniex(None, None)
 __log_formatter__ = logging.Formatter('-'*50 + '\n%(levelname)s: %(asctime)s\n%(message)s')
 __log_file_handler__ = logging.FileHandler(datetime.today().strftime('%Y%m%d') + '_psb.log', mode='a')
 __log_file_handler__.setFormatter(__log_formatter__)
+__log_queue__ = queue.Queue(-1)
 __log__ = logging.getLogger('poloniex_scraping_bot_logger')
 __log__.setLevel(logging.DEBUG)
-__log__.addHandler(__log_file_handler__)
-__mongo_client__ = MongoClient()
-__poloniex_mongo_collection__ = __mongo_client__.poloniex
+__log__.addHandler(QueueHandler(__log_queue__))
+__log_listener__ = QueueListener(__log_queue__, __log_file_handler__, respect_handler_level=True)
+__log_listener__.start()
+__poloniex_mongo_collection__ = pm.__poloniex_mongo_collection__
 __poloniex_tickers__ = __poloniex_mongo_collection__.tickers
+__pending_tickers__ = []
+__pending_since__ = None
 
-def get_new_ticker_data(insert_to_database=True):
+def flush_pending_tickers():
+    '''
+    Method that writes the accumulated ticker snapshots to database.
+    Registered with atexit so a restart between batches does not drop them.
+    '''
+    global __pending_since__
+    if __pending_tickers__:
+        __poloniex_tickers__.insert_many(__pending_tickers__, ordered=False)
+        __pending_tickers__.clear()
+    __pending_since__ = None
+
+atexit.register(flush_pending_tickers)
+
+def get_new_ticker_data(insert_to_database=True, batch_size=1000, max_pending_seconds=300):
     '''
     Method that returns Poloniex ticker data.
+    Ticker snapshots are accumulated across calls and flushed to database
+    in one unordered bulk write once batch_size documents are pending or
+    the oldest pending snapshot is max_pending_seconds old.
     Examples:
         - Insert ticker data to database:
             get_new_ticker_data()
         - Return ticker data:
             get_new_ticker_data(False)
     '''
+    global __pending_since__
     __log__.info('get_new_ticker_data()')
     try:
         tickers_dict = __poloniex__.return_ticker()
-        tickers = []
-        for market in tickers_dict:
-            ticker = tickers_dict[market]
-            ticker['market'] = market
-            ticker['time'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            tickers += [ticker]
+        snapshot_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        tickers = [{**ticker, 'market': market, 'time': snapshot_time}
+                   for market, ticker in tickers_dict.items()]
         if insert_to_database:
-            __poloniex_tickers__.insert_many(tickers)
+            if not __pending_tickers__:
+                __pending_since__ = time.monotonic()
+            __pending_tickers__.extend(tickers)
+            if len(__pending_tickers__) >= batch_size or time.monotonic() - __pending_since__ >= max_pending_seconds:
+                flush_pending_tickers()
     except Exception:
         __log__.exception('Public ticker data method error')
     if not insert_to_database:
@@ -12,24 +12,117 @@ Examples:
         import poloniex_wrapper as pw
         __poloniex__ = pw.Poloniex('xxx-xxx-xxx-xxx', b'0123456789abcdef')
         __poloniex__.return_balances()
+
+Nothing in this module reads __doc__ at runtime, so production bots can run
+under python -OO to strip the sample-output docstrings from the bytecode.
 '''
 
-import urllib
-from urllib.request import urlopen, Request
-import urllib.error
-import json
+import urllib.parse
+import itertools
+try:
+    import orjson as _json
+except ImportError:
+    try:
+        import ujson as _json
+    except ImportError:
+        import json as _json
+try:
+    import ijson
+except ImportError:
+    ijson = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+import os
 import time
+import threading
 import hmac
 import hashlib
 from datetime import datetime
 import logging
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+__session__ = requests.Session()
+__session__.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=32,
+                                          max_retries=Retry(total=5, backoff_factor=0.3,
+                                                            status_forcelist=[429, 500, 502, 503, 504],
+                                                            allowed_methods=frozenset(['GET', 'POST']))))
+__session__.headers.update({'User-Agent': 'Mozilla/5.0',
+                            'Connection': 'keep-alive',
+                            'Accept-Encoding': 'gzip, deflate'})
+
+__log__ = logging.getLogger('poloniex_wrapper_logger')
+if not __log__.handlers:
+    __log_file_handler__ = logging.FileHandler(datetime.today().strftime('%Y%m%d') + '_pw.log', mode='a')
+    __log_file_handler__.setFormatter(logging.Formatter('-'*50 + '\n%(levelname)s: %(asctime)s\n%(message)s'))
+    __log__.addHandler(__log_file_handler__)
+    __log__.setLevel(logging.DEBUG)
 
 def create_time_stamp(datestr, date_format="%Y-%m-%d %H:%M:%S"):
     '''
     Method that converts date and time string to timestamp.
+    API dates are always "%Y-%m-%d %H:%M:%S", so that default is parsed by
+    slicing the fixed positions instead of going through strptime's
+    locale-aware format walker; other formats still fall back to strptime.
     '''
+    if date_format == "%Y-%m-%d %H:%M:%S":
+        return datetime(int(datestr[0:4]), int(datestr[5:7]), int(datestr[8:10]),
+                        int(datestr[11:13]), int(datestr[14:16]), int(datestr[17:19])).timestamp()
     return time.mktime(time.strptime(datestr, date_format))
 
+def cache_loans(loans, file_name='loans_cache.cbor'):
+    '''
+    Method that persists a parsed loans response to a local cache file.
+    CBOR keeps the numeric-heavy loan records smaller than JSON text and
+    reloads without re-parsing quoted numbers; when cbor2 is not installed
+    the cache is written as JSON bytes instead, under the same file name.
+    '''
+    with open(file_name, 'wb') as cache_file:
+        if cbor2 is not None:
+            cache_file.write(cbor2.dumps(loans))
+        else:
+            dumped = _json.dumps(loans)
+            cache_file.write(dumped if isinstance(dumped, bytes) else dumped.encode())
+
+def load_cached_loans(file_name='loans_cache.cbor'):
+    '''
+    Method that reloads a loans response cached by cache_loans.
+    Returns None when no cache file exists yet.
+    '''
+    if not os.path.isfile(file_name):
+        return None
+    with open(file_name, 'rb') as cache_file:
+        raw = cache_file.read()
+    return cbor2.loads(raw) if cbor2 is not None else _json.loads(raw)
+
+if msgspec is not None:
+    class LoanEntry(msgspec.Struct):
+        """
+        Typed lending-history record. msgspec decodes the raw JSON bytes
+        straight into these structs in one C pass, with no intermediate dict.
+        Numeric fields stay as the API's quoted-decimal strings.
+        """
+        id: int
+        currency: str
+        rate: str
+        amount: str
+        duration: str
+        interest: str
+        fee: str
+        earned: str
+        open: str
+        close: str
+else:
+    LoanEntry = None
+
 class ApiQueryParams:
     '''
     Class with names of api query parameters as constants.
@@ -107,111 +200,360 @@ class Poloniex:
     Class for communication with Poloniex web API.
     '''
     __url_root__ = 'https://poloniex.com/'
+    __slots__ = ('api_key', 'secret', '_all_markets', '_btc_markets',
+                 'aiohttp_session', '_cache', '_trading_cache', '_public_url',
+                 '_trading_url', '_hmac_template', '_static_bodies',
+                 '_trading_headers', '_nonce', '_tls', 'log')
+    # TTL in seconds for cacheable public API commands; None means the
+    # response never changes (closed chart data windows) and is kept forever.
+    __public_cache_ttls__ = {
+        'returnTicker': 1,
+        'return24hVolume': 30,
+        'returnCurrencies': 3600,
+        'returnChartData': None
+    }
 
     def __init__(self, api_key, secret):
         self.api_key = api_key
         self.secret = secret
-        self.markets = None
-        log_formatter = logging.Formatter('-'*50 + '\n%(levelname)s: %(asctime)s\n%(message)s')
-        log_file_handler = logging.FileHandler(datetime.today().strftime('%Y%m%d') + '_pw.log', mode='a')
-        log_file_handler.setFormatter(log_formatter)
-        self.log = logging.getLogger('poloniex_wrapper_logger')
-        self.log.setLevel(logging.DEBUG)
-        self.log.addHandler(log_file_handler)
+        self._all_markets = None
+        self._btc_markets = None
+        self.aiohttp_session = None
+        self._cache = {}
+        self._trading_cache = {}
+        self._public_url = self.__url_root__ + 'public'
+        self._trading_url = self.__url_root__ + 'tradingApi'
+        # HMAC key schedule is run once here; api_query signs with a copy of
+        # this template instead of re-deriving the key per request.
+        self._hmac_template = hmac.new(secret, b'', hashlib.sha512) if secret is not None else None
+        self._tls = threading.local()
+        # Pre-encoded bodies for the no-argument trading commands; api_query
+        # only appends the nonce instead of urlencoding the same dict again.
+        self._static_bodies = {command: b'command=' + command.encode()
+                               for command in ('returnBalances',
+                                               'returnDepositAddresses',
+                                               'returnFeeInfo',
+                                               'returnTradableBalances',
+                                               'returnMarginAccountSummary',
+                                               'returnOpenLoanOffers',
+                                               'returnActiveLoans')}
+        # Strictly increasing nonce source; seeding from wall-clock ms keeps
+        # it ahead of any nonce a previous process of this key ever sent.
+        self._nonce = itertools.count(time.time_ns() // 1_000_000)
+        # Invariant trading headers; each call unpacks these into a fresh dict
+        # together with its own 'Sign', so threads never share a mutable dict.
+        self._trading_headers = {'Key': api_key,
+                                 'Content-Type': 'application/x-www-form-urlencoded'}
+        self.log = __log__
 
     def post_process(self, before):
         '''
         Method adds timestamp from datetime string.
         '''
-        after = before
-        if 'return' in after and isinstance(after['return'], list):
-            for x in range(len(after['return'])):
-                if isinstance(after['return'][x], dict) and 'datetime' in after['return'][x] and 'timestamp' not in after['return'][x]:
-                    after['return'][x]['timestamp'] = float(create_time_stamp(after['return'][x]['datetime']))
-        return after
+        rows = before.get('return') if isinstance(before, dict) else None
+        if not isinstance(rows, list):
+            return before
+        for row in rows:
+            if isinstance(row, dict) and 'datetime' in row and 'timestamp' not in row:
+                row['timestamp'] = create_time_stamp(row['datetime'])
+        return before
 
     def build_api_query_url(self, params):
         '''
         Method generates API query URL with parameters for API methods including command.
         '''
-        query_url = Poloniex.__url_root__ + 'public'
-        if params != None and any(params):
-            query_url += '?' + '&'.join([p + '=' + str(params[p]) for p in params])
+        query_url = self._public_url
+        if params:
+            query_url += '?' + urllib.parse.urlencode(params)
         return query_url
 
     def api_query(self, api_method_type, params):
         '''
         Method for sending requests to API.
         '''
-        for key, val in params.copy().items():
-            if val is not None:
-                if isinstance(val, float):
-                    params[key] = '{:.8f}'.format(val)
-                else:
-                    params[key] = val
-            else:
-                del params[key]
-
-        if ApiQueryParams.__start__ in params and isinstance(params[ApiQueryParams.__start__], datetime):
-            params[ApiQueryParams.__start__] = params[ApiQueryParams.__start__].timestamp()
-        if ApiQueryParams.__end__ in params and isinstance(params[ApiQueryParams.__end__], datetime):
-            params[ApiQueryParams.__end__] = params[ApiQueryParams.__end__].timestamp()
+        params = {key: (f'{val:.8f}' if isinstance(val, float)
+                        else val.timestamp() if isinstance(val, datetime)
+                        else val)
+                  for key, val in params.items() if val is not None}
 
         if api_method_type is ApiPublicMethods:
+            command = params.get('command')
+            cache_key = None
+            if command in Poloniex.__public_cache_ttls__:
+                ttl = Poloniex.__public_cache_ttls__[command]
+                # A chart window only stops changing once its last candle has
+                # closed; end timestamps near now (live polling loops) must not
+                # be cached, or every poll would retain a never-hit key.
+                if command != 'returnChartData' or float(params.get('end', 0)) + float(params.get('period', 0)) < time.time():
+                    cache_key = tuple(sorted(params.items()))
+                    cached = self._cache.get(cache_key)
+                    if cached is not None and (ttl is None or time.monotonic() - cached[0] < ttl):
+                        return cached[1]
             url_from_params = self.build_api_query_url(params)
             self.log.info('ApiPublicMethods\nURL open: %s', url_from_params)
             try:
-                ret = urlopen(Request(url_from_params, headers={'User-Agent': 'Mozilla/5.0'}))
-                return json.loads(ret.read())
+                ret = __session__.get(url_from_params)
+                json_ret = _json.loads(ret.content)
+                # Poloniex reports failures as {'error': ...} dicts with a 200
+                # status; caching those would pin the failure (forever for
+                # chart data, whose windows only ever hold lists of candles).
+                if cache_key is not None and json_ret is not None \
+                        and not (isinstance(json_ret, dict) and 'error' in json_ret) \
+                        and (command != 'returnChartData' or isinstance(json_ret, list)):
+                    self._cache[cache_key] = (time.monotonic(), json_ret)
+                return json_ret
             except Exception:
                 self.log.exception('Communication error')
-                return json.loads(None)
+                return None
         elif api_method_type is ApiTradingMethods:
-            params['nonce'] = int(time.time()*1000)
-            post_data = urllib.parse.urlencode(params).encode()
+            nonce = next(self._nonce)
+            if len(params) == 1 and params.get('command') in self._static_bodies:
+                post_data = self._static_bodies[params['command']] + b'&nonce=%d' % nonce
+            else:
+                params['nonce'] = nonce
+                post_data = urllib.parse.urlencode(params).encode()
 
-            sign = hmac.new(self.secret, post_data, hashlib.sha512).hexdigest()
-            headers = {
-                'Sign': sign,
-                'Key': self.api_key,
-                'User-Agent': 'Mozilla/5.0'
-            }
+            headers = {**self._trading_headers, 'Sign': self._signer(post_data)}
 
-            self.log.info('ApiTradingMethods\nURL open: %s\nPost data: %s\nHeaders: %s',
-                          self.__url_root__ + 'tradingApi',
-                          post_data,
-                          '{' + ', '.join('{}:{}'.format(key, [val, 'None'][val is None]) for key, val in headers.items()) + '}')
+            if self.log.isEnabledFor(logging.INFO):
+                self.log.info('ApiTradingMethods\nURL open: %s\nPost data: %s\nHeaders: %s',
+                              self._trading_url, post_data, headers)
             try:
-                ret = urlopen(Request(self.__url_root__ + 'tradingApi', post_data, headers))
-                json_ret = json.loads(ret.read())
+                ret = __session__.post(self._trading_url, data=post_data, headers=headers)
+                json_ret = _json.loads(ret.content)
                 return self.post_process(json_ret)
             except Exception:
                 self.log.exception('Communication error')
-                return json.loads(None)
+                return None
+
+    def api_query_raw(self, api_method_type, params):
+        '''
+        Variant of api_query that returns the raw JSON response bytes.
+        For proxies and dashboards that re-serve Poloniex data over HTTP, the
+        bytes can be passed straight through as an application/json body,
+        skipping the loads/dumps round trip entirely. Responses are neither
+        cached nor post-processed here.
+        '''
+        params = {key: (f'{val:.8f}' if isinstance(val, float)
+                        else val.timestamp() if isinstance(val, datetime)
+                        else val)
+                  for key, val in params.items() if val is not None}
+
+        if api_method_type is ApiPublicMethods:
+            url_from_params = self.build_api_query_url(params)
+            self.log.info('ApiPublicMethods\nURL open: %s', url_from_params)
+            try:
+                return __session__.get(url_from_params).content
+            except Exception:
+                self.log.exception('Communication error')
+                return None
+        elif api_method_type is ApiTradingMethods:
+            params['nonce'] = next(self._nonce)
+            post_data = urllib.parse.urlencode(params).encode()
+            headers = {**self._trading_headers, 'Sign': self._signer(post_data)}
+            if self.log.isEnabledFor(logging.INFO):
+                self.log.info('ApiTradingMethods\nURL open: %s\nPost data: %s\nHeaders: %s',
+                              self._trading_url, post_data, headers)
+            try:
+                return __session__.post(self._trading_url, data=post_data, headers=headers).content
+            except Exception:
+                self.log.exception('Communication error')
+                return None
+
+    def _signer(self, post_data):
+        '''
+        Method that signs a request body with a per-thread HMAC copy.
+        Grid bots run one thread per symbol; each thread clones the pre-keyed
+        template once into thread-local storage so interleaved update() calls
+        never share a digest object across threads.
+        '''
+        template = getattr(self._tls, 'hmac_template', None)
+        if template is None:
+            template = self._hmac_template.copy()
+            self._tls.hmac_template = template
+        signer = template.copy()
+        signer.update(post_data)
+        return signer.hexdigest()
+
+    def _cached_trading_query(self, command, ttl=1.0):
+        '''
+        Method that memoizes a no-argument trading query for ttl seconds.
+        Mutating calls (orders, transfers) clear the cache so a stale balance
+        is never served after a trade.
+        '''
+        cached = self._trading_cache.get(command)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+        ret = self.api_query(ApiTradingMethods, {'command': command})
+        if ret is not None:
+            self._trading_cache[command] = (time.monotonic(), ret)
+        return ret
+
+    async def aapi_query(self, params):
+        '''
+        Async counterpart of api_query for public API methods.
+        Shares one lazily created aiohttp session per Poloniex instance, so
+        concurrent polls gathered with asyncio.gather reuse the connection.
+        '''
+        params = {key: (f'{val:.8f}' if isinstance(val, float)
+                        else val.timestamp() if isinstance(val, datetime)
+                        else val)
+                  for key, val in params.items() if val is not None}
+
+        if self.aiohttp_session is None:
+            self.aiohttp_session = aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0',
+                                                                  'Accept-Encoding': 'gzip, deflate'})
+        url_from_params = self.build_api_query_url(params)
+        self.log.info('ApiPublicMethods\nURL open: %s', url_from_params)
+        try:
+            async with self.aiohttp_session.get(url_from_params) as ret:
+                return _json.loads(await ret.read())
+        except Exception:
+            self.log.exception('Communication error')
+            return None
+
+    async def aapi_trading_query(self, params):
+        '''
+        Async counterpart of api_query for trading API methods.
+        Signs and posts on the shared aiohttp session, so independent
+        read-only calls can be dispatched together with asyncio.gather and
+        pay max(RTT) instead of sum(RTT).
+        '''
+        params = {key: (f'{val:.8f}' if isinstance(val, float)
+                        else val.timestamp() if isinstance(val, datetime)
+                        else val)
+                  for key, val in params.items() if val is not None}
+        params['nonce'] = next(self._nonce)
+        post_data = urllib.parse.urlencode(params).encode()
+        headers = {**self._trading_headers, 'Sign': self._signer(post_data)}
+
+        if self.aiohttp_session is None:
+            self.aiohttp_session = aiohttp.ClientSession(headers={'User-Agent': 'Mozilla/5.0',
+                                                                  'Accept-Encoding': 'gzip, deflate'})
+        if self.log.isEnabledFor(logging.INFO):
+            self.log.info('ApiTradingMethods\nURL open: %s\nPost data: %s\nHeaders: %s',
+                          self._trading_url, post_data, headers)
+        try:
+            async with self.aiohttp_session.post(self._trading_url, data=post_data, headers=headers) as ret:
+                return self.post_process(_json.loads(await ret.read()))
+        except Exception:
+            self.log.exception('Communication error')
+            return None
+
+    # Async variants of the read-only trading methods a dashboard polls
+
+    async def areturn_tradable_balances(self):
+        '''
+        Async variant of return_tradable_balances.
+        '''
+        return await self.aapi_trading_query({'command': 'returnTradableBalances'})
+
+    async def areturn_margin_account_summary(self):
+        '''
+        Async variant of return_margin_account_summary.
+        '''
+        return await self.aapi_trading_query({'command': 'returnMarginAccountSummary'})
+
+    async def areturn_open_loan_offers(self):
+        '''
+        Async variant of return_open_loan_offers.
+        '''
+        return await self.aapi_trading_query({'command': 'returnOpenLoanOffers'})
+
+    async def areturn_active_loans(self):
+        '''
+        Async variant of return_active_loans.
+        '''
+        return await self.aapi_trading_query({'command': 'returnActiveLoans'})
+
+    async def aclose(self):
+        '''
+        Method that closes the aiohttp session opened by the async API methods.
+        '''
+        if self.aiohttp_session is not None:
+            await self.aiohttp_session.close()
+            self.aiohttp_session = None
+
+    # Async variants of the public API methods, awaitable concurrently
+
+    async def areturn_ticker(self):
+        '''
+        Async variant of return_ticker.
+        '''
+        return await self.aapi_query({'command': 'returnTicker'})
+
+    async def areturn_24h_volume(self):
+        '''
+        Async variant of return_24h_volume.
+        '''
+        return await self.aapi_query({'command': 'return24hVolume'})
+
+    async def areturn_order_book(self, currency_pair='all', depth=10):
+        '''
+        Async variant of return_order_book.
+        '''
+        return await self.aapi_query({
+            'command': 'returnOrderBook',
+            'currencyPair': currency_pair,
+            'depth': depth
+        })
+
+    async def areturn_public_trade_history(self, currency_pair, start, end):
+        '''
+        Async variant of return_public_trade_history.
+        '''
+        return await self.aapi_query({
+            'command': 'returnTradeHistory',
+            'currencyPair': currency_pair,
+            'start': start,
+            'end': end
+        })
+
+    async def areturn_chart_data(self, currency_pair, start, end, period):
+        '''
+        Async variant of return_chart_data.
+        '''
+        return await self.aapi_query({
+            'command': 'returnChartData',
+            'currencyPair': currency_pair,
+            'start': start,
+            'end': end,
+            'period': period
+        })
 
     def get_all_markets(self):
         '''
         Get all markets from return_24h_volume public API method.
         '''
-        if self.markets is None:
-            self.markets = []
+        if self._all_markets is None:
             volumes = self.return_24h_volume()
-            for market in volumes:
-                if isinstance(volumes[market], dict):
-                    self.markets.append(market)
-        return self.markets
+            self._all_markets = [market for market, volume in volumes.items()
+                                 if isinstance(volume, dict)]
+        return self._all_markets
 
     def get_all_btc_markets(self):
         '''
-        Get all markets from return_24h_volume public API method.
-        '''
-        if self.markets is None:
-            self.markets = []
+        Get all BTC markets from return_ticker public API method.
+        '''
+        if self._btc_markets is None:
+            if ijson is not None:
+                # Stream the ticker and collect market keys as they arrive,
+                # overlapping download and parse instead of materializing the
+                # whole per-market dict first.
+                url = self._public_url + '?command=returnTicker'
+                self.log.info('ApiPublicMethods\nURL open: %s', url)
+                try:
+                    ret = __session__.get(url, stream=True)
+                    ret.raw.decode_content = True
+                    self._btc_markets = [market for market, volume in ijson.kvitems(ret.raw, '')
+                                         if isinstance(volume, dict) and market.startswith('BTC_')]
+                    return self._btc_markets
+                except Exception:
+                    self.log.exception('Communication error')
             volumes = self.return_ticker()
-            for market in volumes:
-                if isinstance(volumes[market], dict) and market[:3] == 'BTC':
-                    self.markets.append(market)
-        return self.markets
+            self._btc_markets = [market for market, volume in volumes.items()
+                                 if isinstance(volume, dict) and market.startswith('BTC_')]
+        return self._btc_markets
 
     # Implementation of public API methods
 
@@ -225,7 +567,7 @@ class Poloniex:
         Call: https://poloniex.com/public?command=returnTicker
         '''
         return self.api_query(ApiPublicMethods,
-                              {ApiQueryParams.__command__: ApiPublicMethods.__return_ticker__})
+                              {'command': 'returnTicker'})
 
     def return_24h_volume(self):
         '''
@@ -237,7 +579,7 @@ class Poloniex:
         Call: https://poloniex.com/public?command=return24hVolume
         '''
         return self.api_query(ApiPublicMethods,
-                              {ApiQueryParams.__command__: ApiPublicMethods.__return_24h_volume__})
+                              {'command': 'return24hVolume'})
 
     def return_order_book(self, currency_pair='all', depth=10):
         '''
@@ -253,9 +595,9 @@ class Poloniex:
         '''
         return self.api_query(ApiPublicMethods,
                               {
-                                  ApiQueryParams.__command__: ApiPublicMethods.__return_order_book__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__depth__: depth
+                                  'command': 'returnOrderBook',
+                                  'currencyPair': currency_pair,
+                                  'depth': depth
                               })
 
     def return_public_trade_history(self, currency_pair, start, end):
@@ -269,10 +611,10 @@ class Poloniex:
         '''
         return self.api_query(ApiPublicMethods,
                               {
-                                  ApiQueryParams.__command__: ApiPublicMethods.__return_trade_history__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__start__: start,
-                                  ApiQueryParams.__end__: end
+                                  'command': 'returnTradeHistory',
+                                  'currencyPair': currency_pair,
+                                  'start': start,
+                                  'end': end
                               })
 
     def return_chart_data(self, currency_pair, start, end, period):
@@ -286,11 +628,11 @@ class Poloniex:
         '''
         return self.api_query(ApiPublicMethods,
                               {
-                                  ApiQueryParams.__command__: ApiPublicMethods.__return_chart_data__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__start__: start,
-                                  ApiQueryParams.__end__: end,
-                                  ApiQueryParams.__period__: period
+                                  'command': 'returnChartData',
+                                  'currencyPair': currency_pair,
+                                  'start': start,
+                                  'end': end,
+                                  'period': period
                               })
 
     def return_currencies(self, currency):
@@ -305,8 +647,8 @@ class Poloniex:
         '''
         return self.api_query(ApiPublicMethods,
                               {
-                                  ApiQueryParams.__command__: ApiPublicMethods.__return_currencies__,
-                                  ApiQueryParams.__currency__: currency
+                                  'command': 'returnCurrencies',
+                                  'currency': currency
                               })
 
     def return_loan_orders(self, currency):
@@ -320,8 +662,8 @@ class Poloniex:
         '''
         return self.api_query(ApiPublicMethods,
                               {
-                                  ApiQueryParams.__command__: ApiPublicMethods.__return_loan_orders__,
-                                  ApiQueryParams.__currency__: currency
+                                  'command': 'returnLoanOrders',
+                                  'currency': currency
                               })
 
     # Implementation of trading API methods
@@ -335,7 +677,7 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_balances__
+                                  'command': 'returnBalances'
                               })
 
     def return_complete_balances(self, account='all'):
@@ -347,8 +689,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_complete_balances__,
-                                  ApiQueryParams.__account__: account
+                                  'command': 'returnCompleteBalances',
+                                  'account': account
                               })
 
     def return_deposit_addresses(self):
@@ -360,7 +702,7 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_deposit_addresses__
+                                  'command': 'returnDepositAddresses'
                               })
 
     def generate_new_address(self, currency):
@@ -374,8 +716,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__generate_new_address__,
-                                  ApiQueryParams.__currency__: currency
+                                  'command': 'generateNewAddress',
+                                  'currency': currency
                               })
 
     def return_deposits_withdrawals(self, start, end):
@@ -387,9 +729,9 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_deposits_withdrawals__,
-                                  ApiQueryParams.__start__: start,
-                                  ApiQueryParams.__end__: end
+                                  'command': 'returnDepositsWithdrawals',
+                                  'start': start,
+                                  'end': end
                               })
 
     def return_open_orders(self, currency_pair='all'):
@@ -403,8 +745,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_open_orders__,
-                                  ApiQueryParams.__currency_pair__: currency_pair
+                                  'command': 'returnOpenOrders',
+                                  'currencyPair': currency_pair
                               })
 
     def return_trade_history(self, currency_pair='all', start=None, end=None):
@@ -418,10 +760,10 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_trade_history__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__start__: start,
-                                  ApiQueryParams.__end__: end
+                                  'command': 'returnTradeHistory',
+                                  'currencyPair': currency_pair,
+                                  'start': start,
+                                  'end': end
                               })
 
     def return_order_trades(self, order_number):
@@ -433,8 +775,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_order_trades__,
-                                  ApiQueryParams.__order_number__: order_number
+                                  'command': 'returnOrderTrades',
+                                  'orderNumber': order_number
                               })
 
     def buy(self, currency_pair, rate, amount, fill_or_kill=None, immediate_or_cancel=None, post_only=None):
@@ -448,13 +790,13 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__buy__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__rate__: rate,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__fill_or_kill__: fill_or_kill,
-                                  ApiQueryParams.__immediate_or_cancel__: immediate_or_cancel,
-                                  ApiQueryParams.__post_only__: post_only
+                                  'command': 'buy',
+                                  'currencyPair': currency_pair,
+                                  'rate': rate,
+                                  'amount': amount,
+                                  'fillOrKill': fill_or_kill,
+                                  'immediateOrCancel': immediate_or_cancel,
+                                  'postOnly': post_only
                               })
 
     def sell(self, currency_pair, rate, amount, fill_or_kill=None, immediate_or_cancel=None, post_only=None):
@@ -465,13 +807,13 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__sell__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__rate__: rate,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__fill_or_kill__: fill_or_kill,
-                                  ApiQueryParams.__immediate_or_cancel__: immediate_or_cancel,
-                                  ApiQueryParams.__post_only__: post_only
+                                  'command': 'sell',
+                                  'currencyPair': currency_pair,
+                                  'rate': rate,
+                                  'amount': amount,
+                                  'fillOrKill': fill_or_kill,
+                                  'immediateOrCancel': immediate_or_cancel,
+                                  'postOnly': post_only
                               })
 
     def cancel_order(self, order_number):
@@ -483,8 +825,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__cancel_order__,
-                                  ApiQueryParams.__order_number__: order_number
+                                  'command': 'cancelOrder',
+                                  'orderNumber': order_number
                               })
 
     def move_order(self, order_number, rate, amount=None, post_only=None, immediate_or_cancel=None):
@@ -496,12 +838,12 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__move_order__,
-                                  ApiQueryParams.__order_number__: order_number,
-                                  ApiQueryParams.__rate__: rate,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__post_only__: post_only,
-                                  ApiQueryParams.__immediate_or_cancel__: immediate_or_cancel
+                                  'command': 'moveOrder',
+                                  'orderNumber': order_number,
+                                  'rate': rate,
+                                  'amount': amount,
+                                  'postOnly': post_only,
+                                  'immediateOrCancel': immediate_or_cancel
                               })
 
     def withdraw(self, currency, amount, address, payment_id=None):
@@ -513,11 +855,11 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__withdraw__,
-                                  ApiQueryParams.__currency__: currency,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__address__: address,
-                                  ApiQueryParams.__payment_id__: payment_id
+                                  'command': 'withdraw',
+                                  'currency': currency,
+                                  'amount': amount,
+                                  'address': address,
+                                  'paymentId': payment_id
                               })
 
     def return_fee_info(self):
@@ -529,7 +871,7 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_fee_info__
+                                  'command': 'returnFeeInfo'
                               })
 
     def return_available_account_balances(self, account=None):
@@ -541,8 +883,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_available_account_balances__,
-                                  ApiQueryParams.__account__: account
+                                  'command': 'returnAvailableAccountBalances',
+                                  'account': account
                               })
 
     def return_tradable_balances(self):
@@ -552,10 +894,7 @@ class Poloniex:
         Returns your current tradable balances for each currency in each market for which margin trading is enabled. Please note that these balances may vary continually with market conditions. Sample output:
         {"BTC_DASH":{"BTC":"8.50274777","DASH":"654.05752077"},"BTC_LTC":{"BTC":"8.50274777","LTC":"1214.67825290"},"BTC_XMR":{"BTC":"8.50274777","XMR":"3696.84685650"}}
         '''
-        return self.api_query(ApiTradingMethods,
-                              {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_tradable_balances__
-                              })
+        return self._cached_trading_query('returnTradableBalances')
 
     def transfer_balance(self, currency, amount, from_account, to_account):
         '''
@@ -564,13 +903,14 @@ class Poloniex:
         Transfers funds from one account to another (e.g. from your exchange account to your margin account). Required POST parameters are "currency", "amount", "fromAccount", and "toAccount". Sample output:
         {"success":1,"message":"Transferred 2 BTC from exchange to margin account."}
         '''
+        self._trading_cache.clear()
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__transfer_balance__,
-                                  ApiQueryParams.__currency__: currency,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__from_account__: from_account,
-                                  ApiQueryParams.__to_account__: to_account
+                                  'command': 'transferBalance',
+                                  'currency': currency,
+                                  'amount': amount,
+                                  'fromAccount': from_account,
+                                  'toAccount': to_account
                               })
 
     def return_margin_account_summary(self):
@@ -580,10 +920,7 @@ class Poloniex:
         Returns a summary of your entire margin account. This is the same information you will find in the Margin Account section of the Margin Trading page, under the Markets list. Sample output:
         {"totalValue": "0.00346561","pl": "-0.00001220","lendingFees": "0.00000000","netValue": "0.00345341","totalBorrowedValue": "0.00123220","currentMargin": "2.80263755"}
         '''
-        return self.api_query(ApiTradingMethods,
-                              {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_margin_account_summary__
-                              })
+        return self._cached_trading_query('returnMarginAccountSummary')
 
     def margin_buy(self, currency_pair, rate, amount, lending_rate=None):
         '''
@@ -592,13 +929,14 @@ class Poloniex:
         Places a margin buy order in a given market. Required POST parameters are "currencyPair", "rate", and "amount". You may optionally specify a maximum lending rate using the "lendingRate" parameter. If successful, the method will return the order number and any trades immediately resulting from your order. Sample output:
         {"success":1,"message":"Margin order placed.","orderNumber":"154407998","resultingTrades":{"BTC_DASH":[{"amount":"1.00000000","date":"2015-05-10 22:47:05","rate":"0.01383692","total":"0.01383692","tradeID":"1213556","type":"buy"}]}}
         '''
+        self._trading_cache.clear()
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__margin_buy__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__rate__: rate,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__lending_rate__: lending_rate
+                                  'command': 'marginBuy',
+                                  'currencyPair': currency_pair,
+                                  'rate': rate,
+                                  'amount': amount,
+                                  'lendingRate': lending_rate
                               })
 
     def margin_sell(self, currency_pair, rate, amount, lending_rate=None):
@@ -607,13 +945,14 @@ class Poloniex:
 
         Places a margin sell order in a given market. Parameters and output are the same as for the marginBuy method.
         '''
+        self._trading_cache.clear()
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__margin_sell__,
-                                  ApiQueryParams.__currency_pair__: currency_pair,
-                                  ApiQueryParams.__rate__: rate,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__lending_rate__: lending_rate
+                                  'command': 'marginSell',
+                                  'currencyPair': currency_pair,
+                                  'rate': rate,
+                                  'amount': amount,
+                                  'lendingRate': lending_rate
                               })
 
     def get_margin_position(self, currency_pair='all'):
@@ -625,8 +964,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__get_margin_position__,
-                                  ApiQueryParams.__currency_pair__: currency_pair
+                                  'command': 'getMarginPosition',
+                                  'currencyPair': currency_pair
                               })
 
     def close_margin_position(self, currency_pair):
@@ -636,10 +975,11 @@ class Poloniex:
         Closes your margin position in a given market (specified by the "currencyPair" POST parameter) using a market order. This call will also return success if you do not have an open position in the specified market. Sample output:
         {"success":1,"message":"Successfully closed margin position.","resultingTrades":{"BTC_XMR":[{"amount":"7.09215901","date":"2015-05-10 22:38:49","rate":"0.00235337","total":"0.01669047","tradeID":"1213346","type":"sell"},{"amount":"24.00289920","date":"2015-05-10 22:38:49","rate":"0.00235321","total":"0.05648386","tradeID":"1213347","type":"sell"}]}}
         '''
+        self._trading_cache.clear()
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__close_margin_position__,
-                                  ApiQueryParams.__currency_pair__: currency_pair
+                                  'command': 'closeMarginPosition',
+                                  'currencyPair': currency_pair
                               })
 
     def create_loan_offer(self, currency, amount, duration, auto_renew, lending_rate):
@@ -651,12 +991,12 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__create_loan_offer__,
-                                  ApiQueryParams.__currency__: currency,
-                                  ApiQueryParams.__amount__: amount,
-                                  ApiQueryParams.__duration__: duration,
-                                  ApiQueryParams.__auto_renew__: auto_renew,
-                                  ApiQueryParams.__lending_rate__: lending_rate
+                                  'command': 'createLoanOffer',
+                                  'currency': currency,
+                                  'amount': amount,
+                                  'duration': duration,
+                                  'autoRenew': auto_renew,
+                                  'lendingRate': lending_rate
                               })
 
     def cancel_loan_offer(self, order_number):
@@ -668,8 +1008,8 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__cancel_loan_offer__,
-                                  ApiQueryParams.__order_number__: order_number
+                                  'command': 'cancelLoanOffer',
+                                  'orderNumber': order_number
                               })
 
     def return_open_loan_offers(self):
@@ -681,7 +1021,7 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_open_loan_offers__
+                                  'command': 'returnOpenLoanOffers'
                               })
 
     def return_active_loans(self):
@@ -693,7 +1033,7 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_active_loans__
+                                  'command': 'returnActiveLoans'
                               })
 
     def return_lending_history(self, start, end, limit=None):
@@ -705,12 +1045,63 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__return_lending_history__,
-                                  ApiQueryParams.__start__: start,
-                                  ApiQueryParams.__end__: end,
-                                  ApiQueryParams.__limit__: limit
+                                  'command': 'returnLendingHistory',
+                                  'start': start,
+                                  'end': end,
+                                  'limit': limit
                               })
 
+    def return_lending_history_typed(self, start, end, limit=None):
+        '''
+        Typed variant of return_lending_history.
+        Decodes the raw response bytes directly into LoanEntry structs, so
+        thousands of records skip the dict stage entirely. Requires msgspec.
+        '''
+        if msgspec is None:
+            raise ImportError('msgspec is required for return_lending_history_typed')
+        raw = self.api_query_raw(ApiTradingMethods,
+                                 {
+                                     'command': 'returnLendingHistory',
+                                     'start': start,
+                                     'end': end,
+                                     'limit': limit
+                                 })
+        if raw is None:
+            return None
+        return msgspec.json.decode(raw, type=list[LoanEntry])
+
+    def return_lending_history_iter(self, start, end, limit=None):
+        '''
+        Streaming variant of return_lending_history.
+
+        Parses the response records off the socket with ijson as they arrive,
+        so multi-month histories never need the full list in memory and the
+        caller can start aggregating before the download finishes. Falls back
+        to iterating the buffered return_lending_history result when ijson is
+        not installed. Always returns an iterator; on communication errors it
+        is empty and the failure is logged.
+        '''
+        if ijson is None:
+            ret = self.return_lending_history(start, end, limit)
+            return iter(ret if ret is not None else ())
+        params = {key: (f'{val:.8f}' if isinstance(val, float)
+                        else val.timestamp() if isinstance(val, datetime)
+                        else val)
+                  for key, val in {'command': 'returnLendingHistory',
+                                   'start': start,
+                                   'end': end,
+                                   'limit': limit}.items() if val is not None}
+        params['nonce'] = next(self._nonce)
+        post_data = urllib.parse.urlencode(params).encode()
+        headers = {**self._trading_headers, 'Sign': self._signer(post_data)}
+        try:
+            ret = __session__.post(self._trading_url, data=post_data, headers=headers, stream=True)
+            ret.raw.decode_content = True
+            return ijson.items(ret.raw, 'item')
+        except Exception:
+            self.log.exception('Communication error')
+            return iter(())
+
     def toggle_auto_renew(self, order_number):
         '''
         Trading API method: toggleAutoRenew
@@ -720,6 +1111,6 @@ class Poloniex:
         '''
         return self.api_query(ApiTradingMethods,
                               {
-                                  ApiQueryParams.__command__: ApiTradingMethods.__toggle_auto_renew__,
-                                  ApiQueryParams.__order_number__: order_number
+                                  'command': 'toggleAutoRenew',
+                                  'orderNumber': order_number
                               })